@@ -19,6 +19,10 @@ fi
 echo "Running database import script..."
 python3 scripts/main.py
 
+# Regenerate the report snapshots touched by the new activities
+echo "Generating report snapshots..."
+python3 scripts/reports.py
+
 # Clean up HealthData directory if it exists
 #rm -rf HealthData # Remove existing HealthData directory if it exists
 
@@ -0,0 +1,178 @@
+import os
+import argparse
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+from fitparse import FitFile
+from functions import (
+    connect_writer, get_activity_id, migrate_database, get_pending_backfills, get_backfill_fields,
+    mark_backfilled, record_fit_file, MESSAGE_COLUMNS
+)
+
+# --- Configuration ---
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+DATABASE_FILE = os.path.join(PROJECT_ROOT, "garmin_data.db")
+FIT_FILES_DIRECTORY = os.path.join(PROJECT_ROOT, 'HealthData/FitFiles/Activities/')
+
+# Columns identifying the row updated for each FIT message type
+MESSAGE_KEY_COLUMNS = {
+    'session': ('activity_id',),
+    'lap': ('activity_id', 'lap_number'),
+    'record': ('activity_id', 'timestamp'),
+}
+
+
+def read_backfill_fields(fit_file_path, fields):
+    """
+    Reads the fields needed by the pending backfills from one FIT file, plus the
+    session and lap start times used to build the activity ID. Only these values are
+    extracted, but fitparse still decodes the whole file: the speed-up over a full
+    re-import comes from skipping the database rebuild and from parsing the files in
+    parallel (see backfill_database). Returns the activity ID and, for each message
+    type, one dict of column values per message (in file order, like populate_tables).
+    """
+    rows = {message: [] for message in fields}
+    session_start_times, lap_start_times = [], []
+
+    try:
+        fitfile = FitFile(fit_file_path)
+        for message in fitfile.get_messages(list(set(fields) | {'session', 'lap'})):
+            if message.name == 'session':
+                session_start_times.append(message.get_value('start_time'))
+            elif message.name == 'lap':
+                lap_start_times.append(message.get_value('start_time'))
+
+            if message.name in fields:
+                row = {column: message.get_value(fit_field) for column, fit_field in fields[message.name].items()}
+                if message.name == 'record':
+                    row['timestamp'] = message.get_value('timestamp')
+                rows[message.name].append(row)
+    except Exception as e:
+        print(f"Error opening or parsing {fit_file_path}: {e}")
+        return None, rows
+
+    return get_activity_id(session_start_times, lap_start_times), rows
+
+
+def update_activity(cur, activity_id, rows, fields):
+    """Updates the existing rows of one activity in place with the backfilled values."""
+    for message, columns in fields.items():
+        table, key_columns = MESSAGE_COLUMNS[message][0], MESSAGE_KEY_COLUMNS[message]
+        set_clause = ', '.join(f"{column} = ?" for column in columns)
+        where_clause = ' AND '.join(f"{column} = ?" for column in key_columns)
+
+        params = []
+        for number, row in enumerate(rows[message], 1):
+            keys = {'activity_id': activity_id, 'lap_number': number, 'timestamp': row.get('timestamp')}
+            params.append([row[column] for column in columns] + [keys[column] for column in key_columns])
+        cur.executemany(f"UPDATE {table} SET {set_clause} WHERE {where_clause}", params)
+
+
+def backfill_database(database_file, fit_files_directory, workers=None, retry=False):
+    """
+    Fills the columns added by pending migrations for the activities imported before
+    them. Only the FIT files of these activities are parsed (plus the files never seen
+    before), in parallel worker processes, while the main process writes each activity
+    in its own short transaction. A migration is only marked as backfilled once all of
+    its activities were updated. The activities a pass could not update are not
+    retried automatically, only when retry is set (backfill.py --retry).
+    """
+    pending = get_pending_backfills(database_file)
+    if not pending:
+        return 0
+    versions = [m['version'] for m in pending]
+
+    # Merge the fields of all pending migrations to read every FIT file only once
+    fields = {}
+    for migration in pending:
+        for message, columns in get_backfill_fields(migration).items():
+            fields.setdefault(message, {}).update(columns)
+    print(f"\n--- Backfilling schema versions {', '.join(str(version) for version in versions)} ---")
+
+    con = connect_writer(database_file)
+    cur = con.cursor()
+    placeholders = ', '.join('?' * len(versions))
+    cur.execute(f"""
+        SELECT DISTINCT activity_id FROM pending_backfills
+        WHERE version IN ({placeholders}) AND (attempted_at IS NULL OR ?)
+    """, versions + [retry])
+    missing_ids = {row[0] for row in cur.fetchall()}
+
+    updated_count, failed_count = 0, 0
+    if missing_ids and not os.path.isdir(fit_files_directory):
+        print(f"FIT files directory '{fit_files_directory}' does not exist.")
+    elif missing_ids:
+        cur.execute("SELECT file_name, activity_id FROM fit_files")
+        known_files = dict(cur.fetchall())
+        fit_files = [
+            f for f in os.listdir(fit_files_directory) if f.endswith('.fit') and (
+                f not in known_files or known_files[f] in missing_ids or (retry and known_files[f] is None)
+            )
+        ]
+        print(f"Reading {len(fit_files)} FIT files for {len(missing_ids)} activities.")
+
+        new_files = []
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            fit_file_paths = [os.path.join(fit_files_directory, f) for f in fit_files]
+            results = executor.map(read_backfill_fields, fit_file_paths, repeat(fields), chunksize=4)
+            for fit_file, (activity_id, rows) in zip(fit_files, results):
+                if activity_id is None:
+                    failed_count += 1
+                # Files of activities not imported yet are left to the regular import
+                if activity_id not in missing_ids:
+                    new_files.append((fit_file, activity_id))
+                    continue
+                cur.execute("BEGIN IMMEDIATE;")
+                update_activity(cur, activity_id, rows, fields)
+                cur.execute(
+                    f"DELETE FROM pending_backfills WHERE activity_id = ? AND version IN ({placeholders})",
+                    [activity_id] + versions
+                )
+                record_fit_file(cur, fit_file, activity_id)
+                con.commit()
+                missing_ids.discard(activity_id)
+                updated_count += 1
+
+        cur.execute("BEGIN IMMEDIATE;")
+        for fit_file, activity_id in new_files:
+            record_fit_file(cur, fit_file, activity_id)
+        con.commit()
+
+    # The activities left are only retried on demand, not by every main.py run
+    now = datetime.now().isoformat(timespec='seconds')
+    cur.execute("BEGIN IMMEDIATE;")
+    cur.executemany(
+        f"UPDATE pending_backfills SET attempted_at = ? WHERE activity_id = ? AND version IN ({placeholders})",
+        [[now, activity_id] + versions for activity_id in missing_ids]
+    )
+    cur.execute(f"SELECT COUNT(DISTINCT activity_id) FROM pending_backfills WHERE version IN ({placeholders})", versions)
+    still_pending_count = cur.fetchone()[0]
+    con.commit()
+    con.close()
+
+    mark_backfilled(database_file, versions)
+    print(f"Backfill complete. Updated activities: {updated_count}, not updated: {len(missing_ids)}, "
+          f"FIT files not parsed: {failed_count}")
+    if still_pending_count:
+        print(f"{still_pending_count} activities could not be backfilled and will not be retried automatically. "
+              f"Run 'python3 scripts/backfill.py --retry' once their FIT files are available.")
+    return updated_count
+
+
+def main():
+    """
+    Main function to run the pending backfills on their own, outside of main.py.
+    """
+    parser = argparse.ArgumentParser(description="Backfill the fields added by schema migrations.")
+    parser.add_argument('--retry', action='store_true', help="Retry the activities a previous pass could not update")
+    args = parser.parse_args()
+
+    if not os.path.exists(DATABASE_FILE):
+        print(f"Database file '{DATABASE_FILE}' does not exist. Nothing to backfill.")
+        return
+    migrate_database(DATABASE_FILE)
+    backfill_database(DATABASE_FILE, FIT_FILES_DIRECTORY, retry=args.retry)
+
+
+if __name__ == "__main__":
+    main()
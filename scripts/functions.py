@@ -1,5 +1,7 @@
 import sqlite3
 import os
+import time
+from pathlib import Path
 from fitparse import FitFile
 from datetime import datetime
 import json
@@ -7,6 +9,116 @@ import json
 # The DATABASE_FILE and FIT_FILES_DIRECTORY constants are no longer needed here.
 # They are now managed by main.py.
 
+# --- Concurrency Settings ---
+# The importer writes through WAL so the dashboard can keep reading while it runs.
+BUSY_TIMEOUT_MS = 5000      # How long a connection waits on a lock before giving up
+READ_RETRIES = 5            # Extra attempts for a dashboard read that still hits a lock
+READ_RETRY_BACKOFF_S = 0.05 # First retry delay, doubled on each attempt
+
+
+# --- Database Connections ---
+def connect_writer(database_file):
+    """Opens a connection for the importer, switching the database to WAL mode."""
+    con = sqlite3.connect(database_file, timeout=BUSY_TIMEOUT_MS / 1000)
+    # WAL is persistent: once set, readers are never blocked by the importer's writes
+    con.execute("PRAGMA journal_mode=WAL;")
+    con.execute("PRAGMA synchronous=NORMAL;")
+    con.execute(f"PRAGMA busy_timeout={BUSY_TIMEOUT_MS};")
+    return con
+
+
+def connect_reader(database_file):
+    """Opens a read-only connection for the dashboard."""
+    uri = f"{Path(database_file).resolve().as_uri()}?mode=ro"
+    con = sqlite3.connect(uri, uri=True, timeout=BUSY_TIMEOUT_MS / 1000)
+    con.execute(f"PRAGMA busy_timeout={BUSY_TIMEOUT_MS};")
+    return con
+
+
+def read_with_retry(read_fn, database_file, retries=READ_RETRIES, backoff_s=READ_RETRY_BACKOFF_S):
+    """
+    Runs read_fn(con) inside a single read transaction on a read-only connection.
+    All queries made by read_fn see the same snapshot of the database. If the
+    database is still busy after the busy timeout, the read is retried with an
+    exponential backoff.
+    """
+    for attempt in range(retries + 1):
+        con = connect_reader(database_file)
+        try:
+            con.execute("BEGIN;")
+            result = read_fn(con)
+            con.execute("COMMIT;")
+            return result
+        except sqlite3.OperationalError as e:
+            message = str(e).lower()
+            if attempt == retries or not ("locked" in message or "busy" in message):
+                raise
+            time.sleep(backoff_s * (2 ** attempt))
+        finally:
+            con.close()
+
+
+# --- FIT Field Mappings ---
+# Each table column and the FIT field it is read from. To add a field, add it here
+# and add a migration to MIGRATIONS that creates the column and backfills it.
+ACTIVITY_COLUMNS = {            # from 'session' messages
+    'sport': 'sport',
+    'start_time_gmt': 'start_time',
+    'distance_m': 'total_distance',
+    'total_elapsed_time_s': 'total_elapsed_time',
+    'total_timer_time_s': 'total_timer_time',
+    'calories': 'total_calories',
+    'avg_hr': 'avg_heart_rate',
+    'max_hr': 'max_heart_rate',
+    'avg_cadence': 'avg_running_cadence',
+    'num_laps': 'num_laps',
+    'total_ascent': 'total_ascent',
+    'total_descent': 'total_descent',
+    'workout_rpe': 'unknown_193',   # RPE
+    'workout_feel': 'unknown_192',  # Feel
+}
+LAP_COLUMNS = {                 # from 'lap' messages
+    'start_time_gmt': 'start_time',
+    'distance_m': 'total_distance',
+    'total_elapsed_time_s': 'total_elapsed_time',
+    'total_timer_time_s': 'total_timer_time',
+    'avg_hr': 'avg_heart_rate',
+    'max_hr': 'max_heart_rate',
+    'calories': 'total_calories',
+    'lap_trigger': 'lap_trigger',
+    'avg_cadence': 'avg_running_cadence',   # Schema version 2
+}
+RECORD_COLUMNS = {              # from 'record' messages
+    'timestamp': 'timestamp',
+    'heart_rate': 'heart_rate',
+    'cadence': 'cadence',
+    'distance': 'distance',
+    'power': 'power',
+    'speed': 'enhanced_speed',
+    'altitude': 'enhanced_altitude',
+}
+
+
+def make_activity_id(start_time):
+    """Builds the unique activity ID from the activity start time, e.g. 20250101083000."""
+    return int(start_time.strftime('%Y%m%d%H%M%S'))
+
+
+def get_activity_id(session_start_times, lap_start_times):
+    """
+    Picks the activity ID of a FIT file from the start times of its session and lap
+    messages, in file order. Multisport files have several sessions: the last one is
+    used, as its values are the ones kept in the activities table. The first lap is
+    the fallback when no session has a start time. Returns None if none is known.
+    """
+    session_start_times = [start_time for start_time in session_start_times if start_time]
+    if session_start_times:
+        return make_activity_id(session_start_times[-1])
+    if lap_start_times and lap_start_times[0]:
+        return make_activity_id(lap_start_times[0])
+    return None
+
+
 def get_filtered_activity_data(fit_file_path):
     # ... (this function does not need any changes)
     """
@@ -19,29 +131,19 @@ def get_filtered_activity_data(fit_file_path):
         return None
 
     # --- Define the specific fields you want to keep ---
-    activity_fields_to_keep = [
-        'start_time','sport', 'total_distance', 'total_elapsed_time',
-        'total_timer_time', 'total_calories', 'total_ascent',
-        'total_descent', 'avg_heart_rate', 'max_heart_rate',
-        'avg_running_cadence', 'num_laps','unknown_193','unknown_192'  # RPE and Feel fields
-    ]
-    lap_fields_to_keep = [
-        'start_time', 'total_distance', 'total_elapsed_time',
-        'total_timer_time', 'total_calories', 'avg_heart_rate',
-        'max_heart_rate', 'avg_running_cadence', 'lap_trigger'
-    ]
-    record_fields_to_keep = [
-    'timestamp', 'heart_rate', 'cadence', 'distance', 'power',
-    'enhanced_speed', 'enhanced_altitude'
-    ]
+    activity_fields_to_keep = list(ACTIVITY_COLUMNS.values())
+    lap_fields_to_keep = list(LAP_COLUMNS.values())
+    record_fields_to_keep = list(RECORD_COLUMNS.values())
 
     activity_data = {}
+    session_start_times = []
     laps_data = []
     records_data = []
 
     # Extract data from the .fit file
     for record in fitfile.get_messages(['session', 'lap', 'record']):
         if record.name == 'session':
+            session_start_times.append(record.get_value('start_time'))
             for field in record:
                 if field.name in activity_fields_to_keep:
                     activity_data[field.name] = field.value
@@ -63,20 +165,11 @@ def get_filtered_activity_data(fit_file_path):
            
 
     # Generate and add the unique activity ID
-    if 'start_time' in activity_data:
-        activity_id = int(activity_data['start_time'].strftime('%Y%m%d%H%M%S'))
+    activity_id = get_activity_id(session_start_times, [lap.get('start_time') for lap in laps_data])
+    if activity_id is not None:
         activity_data['activity_id'] = activity_id
         for lap in laps_data:
             lap['activity_id'] = activity_id
-    
-    # Ensure activity_id is always present in the dictionary key
-    if 'activity_id' not in activity_data and laps_data:
-        # Fallback to lap start time if session message is missing start_time
-        first_lap_start_time = laps_data[0].get('start_time')
-        if first_lap_start_time:
-             activity_id = int(first_lap_start_time.strftime('%Y%m%d%H%M%S'))
-             activity_data['activity_id'] = activity_id
-
 
     return {
         "activity": activity_data,
@@ -88,7 +181,7 @@ def get_filtered_activity_data(fit_file_path):
 # --- Database Schema ---
 def create_database(database_file):
     """Creates the SQLite database and all necessary tables."""
-    con = sqlite3.connect(database_file)
+    con = connect_writer(database_file)
     cur = con.cursor()
 
     # Activities Table
@@ -166,9 +259,138 @@ def create_database(database_file):
     
     con.commit()
     con.close()
+
+    # Bring the new database to the latest schema version
+    migrate_database(database_file)
     print(f"Database '{database_file}' is ready.")
 
 
+# --- Schema Migrations ---
+# Version 1 is the schema built by create_database. Each migration adds columns; the
+# ones mapped to a FIT field in ACTIVITY_COLUMNS, LAP_COLUMNS or RECORD_COLUMNS are
+# backfilled from the FIT files for activities imported before it (see backfill.py).
+MIGRATIONS = [
+    {
+        "version": 2,
+        "description": "Store the average running cadence of each lap",
+        "columns": [("laps", "avg_cadence", "REAL")],
+    },
+]
+
+# Table filled from each FIT message type, and its column mapping
+MESSAGE_COLUMNS = {
+    'session': ('activities', ACTIVITY_COLUMNS),
+    'lap': ('laps', LAP_COLUMNS),
+    'record': ('records', RECORD_COLUMNS),
+}
+
+
+def get_backfill_fields(migration):
+    """Returns the FIT fields to backfill for a migration: {message: {column: fit_field}}."""
+    fields = {}
+    for table, column, _ in migration['columns']:
+        for message, (message_table, columns) in MESSAGE_COLUMNS.items():
+            if message_table == table and column in columns:
+                fields.setdefault(message, {})[column] = columns[column]
+    return fields
+
+
+def migrate_database(database_file):
+    """
+    Applies the migrations newer than the recorded schema version, each in its own
+    transaction. Migrations with a backfill are recorded as pending, along with every
+    activity already in the database, until backfill.py has updated them all.
+    """
+    con = connect_writer(database_file)
+    cur = con.cursor()
+    now = datetime.now().isoformat(timespec='seconds')
+
+    cur.execute("BEGIN IMMEDIATE;")
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS schema_migrations (
+        version INTEGER PRIMARY KEY,
+        description TEXT,
+        applied_at TEXT,
+        backfilled_at TEXT
+    );
+    """)
+    # Activities imported before a migration, whose new fields are still empty
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS pending_backfills (
+        version INTEGER,
+        activity_id INTEGER,
+        attempted_at TEXT,
+        PRIMARY KEY (version, activity_id)
+    );
+    """)
+    # Activity read from each FIT file (NULL if the file could not be parsed), so that
+    # a backfill only re-reads the files of the activities it has to update
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS fit_files (
+        file_name TEXT PRIMARY KEY,
+        activity_id INTEGER
+    );
+    """)
+    # Databases created before versioning already have the initial schema
+    cur.execute("""
+        INSERT OR IGNORE INTO schema_migrations (version, description, applied_at, backfilled_at)
+        VALUES (1, 'Initial schema', ?, ?)
+    """, (now, now))
+    cur.execute("SELECT MAX(version) FROM schema_migrations")
+    current_version = cur.fetchone()[0]
+    con.commit()
+
+    for migration in MIGRATIONS:
+        if migration['version'] <= current_version:
+            continue
+        cur.execute("BEGIN IMMEDIATE;")
+        for table, column, column_type in migration['columns']:
+            cur.execute(f"ALTER TABLE {table} ADD COLUMN {column} {column_type}")
+        cur.execute("""
+            INSERT INTO schema_migrations (version, description, applied_at, backfilled_at)
+            VALUES (?, ?, ?, ?)
+        """, (migration['version'], migration['description'], now, None if get_backfill_fields(migration) else now))
+        if get_backfill_fields(migration):
+            cur.execute(
+                "INSERT INTO pending_backfills (version, activity_id) SELECT ?, activity_id FROM activities",
+                (migration['version'],)
+            )
+        con.commit()
+        current_version = migration['version']
+        print(f"Schema migrated to version {current_version}: {migration['description']}")
+
+    con.close()
+    return current_version
+
+
+def get_pending_backfills(database_file):
+    """Returns the migrations whose new fields still have to be backfilled."""
+    con = connect_writer(database_file)
+    cur = con.cursor()
+    cur.execute("SELECT version FROM schema_migrations WHERE backfilled_at IS NULL")
+    pending_versions = {row[0] for row in cur.fetchall()}
+    con.close()
+    return [m for m in MIGRATIONS if m['version'] in pending_versions]
+
+
+def mark_backfilled(database_file, versions):
+    """Marks as done the given backfills that have no activity left to update. Returns their versions."""
+    con = connect_writer(database_file)
+    cur = con.cursor()
+    now = datetime.now().isoformat(timespec='seconds')
+    cur.execute("BEGIN IMMEDIATE;")
+    cur.execute("SELECT DISTINCT version FROM pending_backfills")
+    remaining_versions = {row[0] for row in cur.fetchall()}
+    done_versions = [version for version in versions if version not in remaining_versions]
+    cur.executemany(
+        "UPDATE schema_migrations SET backfilled_at = ? WHERE version = ?",
+        [(now, version) for version in done_versions]
+    )
+    con.commit()
+    con.close()
+    return done_versions
+
+
 
 # def add_or_update_user(user_id, full_name, database_file):
 #     con = sqlite3.connect(database_file)
@@ -185,8 +407,19 @@ def create_database(database_file):
 
 
 
-def populate_tables(data, database_file):
-    """Populates the database tables with activity and lap data."""
+def record_fit_file(cur, fit_file_name, activity_id):
+    """Remembers which activity a FIT file holds (None if it could not be parsed)."""
+    cur.execute(
+        "INSERT OR REPLACE INTO fit_files (file_name, activity_id) VALUES (?, ?)", (fit_file_name, activity_id)
+    )
+
+
+def populate_tables(data, database_file, fit_file_name=None):
+    """
+    Populates the database tables with activity, lap and record data. The columns
+    come from the FIT field mappings, so the schema must be migrated first. The name
+    of the source FIT file is recorded for later backfills.
+    """
     if not data or not data.get('activity'):
         return False
     
@@ -196,85 +429,53 @@ def populate_tables(data, database_file):
     if not activity_id:
         return False
 
-    con = sqlite3.connect(database_file)
+    # One short write transaction per activity: the FIT file is already parsed,
+    # so the write lock is only held while the rows are inserted.
+    con = connect_writer(database_file)
     cur = con.cursor()
+    cur.execute("BEGIN IMMEDIATE;")
 
     # --- Security Check: See if activity_id already exists ---
     cur.execute("SELECT activity_id FROM activities WHERE activity_id = ? ", (activity_id,))
     if cur.fetchone():
         print(f"Activity {activity_id} already exists in the database. Skipping.")
+        if fit_file_name:
+            record_fit_file(cur, fit_file_name, activity_id)
+        con.commit()
         con.close()
         return False
 
+    if fit_file_name:
+        record_fit_file(cur, fit_file_name, activity_id)
+
     # --- Insert Activity Data ---
-    cur.execute("""
-        INSERT INTO activities (
-            activity_id, sport, start_time_gmt, distance_m, 
-            total_elapsed_time_s, total_timer_time_s, calories, 
-            avg_hr, max_hr, avg_cadence, num_laps, total_ascent, total_descent, workout_rpe, workout_feel
-        )
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-    """, (
-        act.get('activity_id'),
-        act.get('sport'),
-        act.get('start_time'),
-        act.get('total_distance'),
-        act.get('total_elapsed_time'),
-        act.get('total_timer_time'),
-        act.get('total_calories'),
-        act.get('avg_heart_rate'),
-        act.get('max_heart_rate'),
-        act.get('avg_running_cadence'),
-        act.get('num_laps'),
-        act.get('total_ascent'),
-        act.get('total_descent'),
-        act.get('unknown_193'),  # workout_rpe
-        act.get('unknown_192')   # workout_feel
-    ))
+    activity_columns = ['activity_id'] + list(ACTIVITY_COLUMNS)
+    cur.execute(f"""
+        INSERT INTO activities ({', '.join(activity_columns)})
+        VALUES ({', '.join('?' * len(activity_columns))})
+    """, [activity_id] + [act.get(fit_field) for fit_field in ACTIVITY_COLUMNS.values()])
 
     # --- Insert Lap Data ---
+    lap_columns = ['activity_id', 'lap_number'] + list(LAP_COLUMNS)
     for i, lap in enumerate(data.get('laps', []), 1):
-        cur.execute("""
-            INSERT INTO laps (
-                activity_id, lap_number, start_time_gmt, distance_m, 
-                total_elapsed_time_s, total_timer_time_s, avg_hr, 
-                max_hr, calories, lap_trigger
-            )
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        """, (
-            lap.get('activity_id'),
-            i,
-            lap.get('start_time'),
-            lap.get('total_distance'),
-            lap.get('total_elapsed_time'),
-            lap.get('total_timer_time'),
-            lap.get('avg_heart_rate'),
-            lap.get('max_heart_rate'),
-            lap.get('total_calories'),
-            lap.get('lap_trigger')
-        ))
+        cur.execute(f"""
+            INSERT INTO laps ({', '.join(lap_columns)})
+            VALUES ({', '.join('?' * len(lap_columns))})
+        """, [activity_id, i] + [lap.get(fit_field) for fit_field in LAP_COLUMNS.values()])
 
     # --- Insert Record Data ---
     records = data.get('records', [])
     if records:
+        record_columns = ['activity_id', 'record_number'] + list(RECORD_COLUMNS)
         records_to_insert = []
         for i, rec in enumerate(records, 1):
-            records_to_insert.append((
-                activity_id,
-                rec.get('timestamp'),
-                i, # This is the new record_number
-                rec.get('heart_rate'),
-                rec.get('cadence'),
-                rec.get('distance'),
-                rec.get('power'),
-                rec.get('enhanced_speed'),
-                rec.get('enhanced_altitude')
-            ))
-        cur.executemany("""
-            INSERT INTO records (
-                activity_id, timestamp, record_number, heart_rate, cadence, distance, power, speed, altitude
+            # i is the record_number
+            records_to_insert.append(
+                [activity_id, i] + [rec.get(fit_field) for fit_field in RECORD_COLUMNS.values()]
             )
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        cur.executemany(f"""
+            INSERT INTO records ({', '.join(record_columns)})
+            VALUES ({', '.join('?' * len(record_columns))})
         """, records_to_insert)
 
 
@@ -320,12 +521,14 @@ def populate_sleep_table(data, database_file):
     if not data:
         return False
 
-    con = sqlite3.connect(database_file)
+    con = connect_writer(database_file)
     cur = con.cursor()
+    cur.execute("BEGIN IMMEDIATE;")
 
     # Security Check: See if sleep_id already exists
     cur.execute("SELECT sleep_id FROM sleep WHERE sleep_id = ? ", (data['sleep_id'],))
     if cur.fetchone():
+        con.rollback()
         con.close()
         return False # Indicates that the data was skipped
 
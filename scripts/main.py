@@ -1,6 +1,7 @@
 
 import os
-from functions import create_database, get_filtered_activity_data, populate_tables, populate_sleep_table, get_sleep_data
+from functions import create_database, migrate_database, get_filtered_activity_data, populate_tables, populate_sleep_table, get_sleep_data
+from backfill import backfill_database
 
 # --- Configuration ---
 # Define the project root directory (one level up from this script's location)
@@ -21,8 +22,11 @@ def main():
         print(f"Database file '{DATABASE_FILE}' does not exist. Creating a new database.")
         create_database(DATABASE_FILE)
 
+    # 2. Bring the schema up to date, then fill new fields for the activities already imported
+    migrate_database(DATABASE_FILE)
+    backfill_database(DATABASE_FILE, FIT_FILES_DIRECTORY)
 
-    # 2. Get the list of .fit files
+    # 3. Get the list of .fit files
     fit_files = [f for f in os.listdir(FIT_FILES_DIRECTORY) if f.endswith('.fit')]
 
     if not fit_files:
@@ -33,7 +37,7 @@ def main():
     imported_files_count = 0
     skipped_files_count = 0
 
-    # 3. Process each .fit file and populate the database
+    # 4. Process each .fit file and populate the database
     for fit_file in fit_files:
         file_path = os.path.join(FIT_FILES_DIRECTORY, fit_file)
         print(f"\n--- Processing File: {fit_file} ---")
@@ -42,7 +46,7 @@ def main():
 
         if extracted_data:
             # Pass the database file path to the populate function
-            if populate_tables(extracted_data, DATABASE_FILE):
+            if populate_tables(extracted_data, DATABASE_FILE, fit_file):
                 imported_files_count += 1
             else:
                 skipped_files_count += 1
@@ -50,7 +54,7 @@ def main():
             print(f"Could not extract data from {fit_file}.")
             skipped_files_count += 1
     
-    # --- 4. Process Sleep Data ---
+    # --- 5. Process Sleep Data ---
     print("\n\n--- Starting Sleep Data Import ---")
     sleep_files = [f for f in os.listdir(SLEEP_FILES_DIRECTORY) if f.startswith('sleep_') and f.endswith('.json')]
 
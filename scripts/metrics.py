@@ -0,0 +1,326 @@
+import numpy as np
+import pandas as pd
+import plotly.express as px
+from datetime import datetime, timedelta
+from functions import read_with_retry
+
+# Shared computations behind the dashboard and the report snapshots (reports.py).
+
+
+# --- Définition des zones personelles (modifié plus tard quand intégré dans la BDD) ---
+# A modifier par personne (cc Nico)
+hr_bins = [0, 153, 173, 188, 195, 204]
+hr_zone_multipliers = { "Z1": 1, "Z2": 2, "Z3": 3, "Z4": 4, "Z5": 5 }
+speed_bins = [0,13,16,19,21,30]  # en km/h
+zone_labels = ["Z1 - Endurance", "Z2 - Marathon", "Z3 - Seuil", "Z4 - VMA", "Z5 - Max"]
+zone_colors = {
+    "Z1 - Endurance": "#d3d3d3",   # Gris clair
+    "Z2 - Marathon": "#add8e6",    # Bleu clair
+    "Z3 - Seuil": "#90ee90",       # Vert clair
+    "Z4 - VMA": "#ffb6c1",         # Orange/rose clair
+    "Z5 - Max": "#f08080"          # Rouge clair
+}
+
+# --- Périodes standard ---
+PERIOD_OPTIONS = ("Cette semaine", "La semaine dernière", "Ce mois-ci", "Le mois dernier", "Année en cours")
+WEEKLY_VOLUME_WEEKS = 10  # Nombre de semaines du graphique des zones de vitesse
+
+
+def get_period_dates(period_option, today):
+    """Retourne les dates de début et de fin d'une des périodes standard."""
+    if period_option == "Cette semaine":
+        start_date = today - timedelta(days=today.weekday())
+        end_date = start_date + timedelta(days=6)
+    elif period_option == "La semaine dernière":
+        start_date = today - timedelta(days=today.weekday() + 7)
+        end_date = start_date + timedelta(days=6)
+    elif period_option == "Ce mois-ci":
+        start_date = today.replace(day=1)
+        end_date = (start_date + timedelta(days=31)).replace(day=1) - timedelta(days=1)
+    elif period_option == "Le mois dernier":
+        last_month_end = today.replace(day=1) - timedelta(days=1)
+        start_date = last_month_end.replace(day=1)
+        end_date = last_month_end
+    elif period_option == "Année en cours":
+        start_date = today.replace(month=1, day=1)
+        end_date = today
+    return start_date, end_date
+
+
+def get_weekly_volume_start(today):
+    """
+    Premier jour pris en compte par le graphique hebdomadaire par zone de vitesse : le
+    lundi d'il y a 9 semaines, pour que la fenêtre reste la même toute la semaine.
+    """
+    return today - timedelta(days=today.weekday(), weeks=WEEKLY_VOLUME_WEEKS - 1)
+
+
+# --- Lecture des records par blocs ---
+# Les records sont lus par blocs triés par activité et agrégés au fur et à mesure :
+# la mémoire utilisée ne dépend plus de la longueur de la période.
+CHUNK_MEMORY_LIMIT_MB = 64   # Plafond mémoire visé pour un bloc de records
+BYTES_PER_RECORD_ROW = 400   # Estimation : ligne sqlite3 en Python + ligne du DataFrame
+SECONDS_PER_DAY = 86400
+RECORD_DTYPES = {
+    'activity_id': 'int64',
+    'timestamp': 'int64',    # secondes depuis l'epoch plutôt que des chaînes de dates
+    'speed': 'float32',
+    'distance': 'float64',   # gardée en float64 : les écarts seconde par seconde sont petits
+    'heart_rate': 'float32',
+}
+
+
+def get_chunksize(memory_limit_mb):
+    """Nombre de records par bloc pour rester sous le plafond mémoire."""
+    return max(1000, int(memory_limit_mb * 1024 * 1024 / BYTES_PER_RECORD_ROW))
+
+
+def read_records_in_chunks(conn, query, memory_limit_mb):
+    """Itère sur le résultat d'une requête par blocs, avec des types compacts."""
+    for chunk in pd.read_sql_query(query, conn, chunksize=get_chunksize(memory_limit_mb)):
+        yield chunk.astype({column: dtype for column, dtype in RECORD_DTYPES.items() if column in chunk.columns})
+
+
+# --- Fonctions de Chargement des données ---
+def load_main_data(database_file, start_date, end_date):
+    # Assurer que les dates sont au bon format pour SQL
+    start_str = start_date.strftime('%Y-%m-%d')
+    end_str = end_date.strftime('%Y-%m-%d')
+
+    query = f"""
+    SELECT * FROM activities WHERE DATE(start_time_gmt) BETWEEN '{start_str}' AND '{end_str}'
+    """
+    # Lecture seule et non bloquante, même pendant un import en cours
+    df_activities = read_with_retry(lambda conn: pd.read_sql_query(query, conn), database_file)
+    return df_activities
+
+
+def load_weekly_volume_by_speed_zone(database_file, today=None, memory_limit_mb=CHUNK_MEMORY_LIMIT_MB):
+    """Charge et calcule le volume hebdomadaire par zone de vitesse pour les 10 dernières semaines."""
+    # On va chercher les données des 10 dernières semaines (semaine en cours comprise)
+    today = today or datetime.now().date()
+    ten_weeks_ago = get_weekly_volume_start(today).strftime('%Y-%m-%d')
+
+    # Jointure pour récupérer la vitesse des records pour les activités de course à pied,
+    # triés par activité pour pouvoir les agréger bloc par bloc. Le tri sur a.activity_id
+    # garde le parcours des seules activités de la période (puis leurs records via la clé
+    # primaire) au lieu d'un parcours de toute la table records.
+    query = f"""
+        SELECT
+            r.activity_id,
+            CAST(strftime('%s', r.timestamp) AS INTEGER) AS timestamp, -- en secondes (epoch)
+            r.speed, -- On récupère la vitesse
+            r.distance
+        FROM records r
+        JOIN activities a ON r.activity_id = a.activity_id
+        WHERE a.sport = 'running' AND DATE(a.start_time_gmt) >= '{ten_weeks_ago}' AND r.timestamp IS NOT NULL
+        ORDER BY a.activity_id, r.timestamp
+    """
+
+    def aggregate(conn):
+        weekly_zone_dist = None
+        has_speed = False
+        # Dernier point du bloc précédent, pour raccorder une activité coupée entre deux blocs
+        last_activity_id, last_distance = None, np.nan
+
+        for chunk in read_records_in_chunks(conn, query, memory_limit_mb):
+            if chunk.empty:
+                continue
+            has_speed = has_speed or chunk['speed'].notna().any()
+
+            # Calcul de la distance par enregistrement (par seconde)
+            distance_per_second = chunk.groupby('activity_id')['distance'].diff()
+            if chunk['activity_id'].iat[0] == last_activity_id:
+                distance_per_second.iat[0] = chunk['distance'].iat[0] - last_distance
+            distance_per_second = distance_per_second.fillna(0)
+            last_activity_id, last_distance = chunk['activity_id'].iat[-1], chunk['distance'].iat[-1]
+
+            # Classification par zone de Vitesse (conversion de m/s en km/h)
+            speed_zone = pd.cut(chunk['speed'] * 3.6, bins=speed_bins, labels=zone_labels, right=False, include_lowest=True)
+
+            # Semaine commençant le Lundi, en jours depuis l'epoch (le 01/01/1970 était un jeudi)
+            day = chunk['timestamp'] // SECONDS_PER_DAY
+            week_start = day - (day + 3) % 7
+
+            # Agrégation partielle de la distance par semaine et par zone, ajoutée au total
+            in_zone = speed_zone.cat.codes >= 0
+            partial = distance_per_second[in_zone].groupby(
+                [week_start[in_zone], speed_zone.cat.codes[in_zone]]
+            ).sum()
+            weekly_zone_dist = partial if weekly_zone_dist is None else weekly_zone_dist.add(partial, fill_value=0)
+
+        return weekly_zone_dist, has_speed
+
+    weekly_zone_dist, has_speed = read_with_retry(aggregate, database_file)
+
+    if weekly_zone_dist is None or not has_speed:
+        return pd.DataFrame()
+
+    # Toutes les zones pour chaque semaine, comme un groupby sur une colonne catégorielle
+    weeks = weekly_zone_dist.index.get_level_values(0).unique().sort_values()
+    zone_codes = range(len(zone_labels))
+    weekly_zone_dist = weekly_zone_dist.reindex(pd.MultiIndex.from_product([weeks, zone_codes]), fill_value=0)
+
+    weekly_zone_dist = pd.DataFrame({
+        'week_start': pd.to_datetime(weekly_zone_dist.index.get_level_values(0), unit='D').strftime('%Y-%m-%d'),
+        'speed_zone': pd.Categorical.from_codes(weekly_zone_dist.index.get_level_values(1), categories=zone_labels, ordered=True),
+        'distance_per_second': weekly_zone_dist.to_numpy(dtype='float64'),
+    })
+    weekly_zone_dist['distance_km'] = weekly_zone_dist['distance_per_second'] / 1000
+
+    # On garde uniquement les 10 semaines les plus récentes
+    recent_weeks = weekly_zone_dist['week_start'].unique()[-10:]
+
+    return weekly_zone_dist[weekly_zone_dist['week_start'].isin(recent_weeks)]
+
+
+def calculate_daily_stress(database_file, start_date, end_date, memory_limit_mb=CHUNK_MEMORY_LIMIT_MB):
+    """Calcule le score de stress quotidien (zTRIMP * RPE) pour la période donnée."""
+    start_str, end_str = start_date.strftime('%Y-%m-%d'), end_date.strftime('%Y-%m-%d')
+
+    records_query = f"""
+        SELECT
+            r.activity_id,
+            r.heart_rate
+        FROM records r
+        JOIN activities a ON r.activity_id = a.activity_id
+        WHERE DATE(a.start_time_gmt) BETWEEN '{start_str}' AND '{end_str}' AND r.heart_rate IS NOT NULL
+        ORDER BY a.activity_id -- voir load_weekly_volume_by_speed_zone
+    """
+    activities_query = f"""
+        SELECT activity_id, workout_rpe, workout_feel, start_time_gmt
+        FROM activities
+        WHERE DATE(start_time_gmt) BETWEEN '{start_str}' AND '{end_str}'
+    """
+
+    def aggregate(conn):
+        # Nombre de secondes par activité et par zone cardiaque, cumulé bloc par bloc
+        seconds_in_zones = None
+        for chunk in read_records_in_chunks(conn, records_query, memory_limit_mb):
+            hr_zone = pd.cut(chunk['heart_rate'], bins=hr_bins, labels=zone_labels, right=True)
+            in_zone = hr_zone.cat.codes >= 0
+            partial = chunk['activity_id'][in_zone].groupby(
+                [chunk['activity_id'][in_zone], hr_zone.cat.codes[in_zone]]
+            ).size()
+            seconds_in_zones = partial if seconds_in_zones is None else seconds_in_zones.add(partial, fill_value=0)
+
+        # Les données par activité sont lues dans la même transaction que les records
+        df_activities = pd.read_sql_query(activities_query, conn)
+        return seconds_in_zones, df_activities
+
+    seconds_in_zones, df_activities = read_with_retry(aggregate, database_file)
+
+    if seconds_in_zones is None:
+        return pd.DataFrame(columns=['activity_date', 'daily_stress_score'])
+
+    # 1. Calcul de la charge objective (zTRIMP)
+    time_in_zones = seconds_in_zones.unstack(fill_value=0).reindex(columns=range(len(zone_labels)), fill_value=0) / 60  # en minutes
+    time_in_zones.columns = pd.CategoricalIndex(zone_labels, categories=zone_labels, ordered=True, name='hr_zone')
+    time_in_zones.index.name = 'activity_id'
+
+    time_in_zones['zTRIMP'] = 0
+    for zone, multiplier in hr_zone_multipliers.items():
+        if zone in time_in_zones.columns:
+            time_in_zones['zTRIMP'] += time_in_zones[zone] * multiplier
+
+    # 2. Calcul du multiplicateur subjectif (RPE & Ressenti)
+    activity_perception = df_activities[['activity_id', 'workout_rpe', 'workout_feel']].set_index('activity_id')
+
+    def get_rpe_multiplier(rpe):
+        if rpe <= 4: return 0.9
+        if rpe <= 6: return 1.0
+        if rpe <= 8: return 1.15
+        return 1.3
+
+    def get_feel_adjustment(feel):
+        if feel <= 30: return 0.1 # Mauvais ressenti, augmente le stress
+        if feel >= 70: return -0.1 # Bon ressenti, diminue le stress
+        return 0.0
+
+    activity_perception['rpe_multiplier'] = activity_perception['workout_rpe'].apply(get_rpe_multiplier)
+    activity_perception['feel_adjustment'] = activity_perception['workout_feel'].apply(get_feel_adjustment)
+    activity_perception['total_multiplier'] = activity_perception['rpe_multiplier'] + activity_perception['feel_adjustment']
+
+    # 3. Calcul du score de stress final par activité
+    final_scores = time_in_zones.join(activity_perception)
+    final_scores.dropna(subset=['zTRIMP', 'total_multiplier'], inplace=True)
+    final_scores['activity_stress_score'] = final_scores['zTRIMP'] * final_scores['total_multiplier']
+
+    # 4. Agrégation par jour
+    activity_dates = df_activities[['activity_id', 'start_time_gmt']].set_index('activity_id')
+    activity_dates['activity_date'] = pd.to_datetime(activity_dates['start_time_gmt']).dt.date
+    final_scores = final_scores.join(activity_dates)
+
+    daily_stress = final_scores.groupby('activity_date')['activity_stress_score'].sum().reset_index()
+    daily_stress.rename(columns={'activity_stress_score': 'daily_stress_score'}, inplace=True)
+
+    return daily_stress
+
+
+# --- Indicateurs et Graphiques ---
+def compute_kpis(df_activities):
+    """Calcule les indicateurs clés affichés en haut du dashboard."""
+    return {
+        "total_kms": df_activities['distance_m'].sum() / 1000,
+        "total_sessions": len(df_activities),
+        "total_temps_minutes": df_activities['total_timer_time_s'].sum() / 60,
+    }
+
+
+def build_daily_stress_figure(df_daily_stress):
+    fig_stress = px.bar(
+        df_daily_stress,
+        x='activity_date',
+        y='daily_stress_score',
+        title="Évolution du Score de Stress Journalier",
+        labels={'activity_date': 'Date', 'daily_stress_score': 'Score de Stress (Points)'}
+    )
+    fig_stress.update_layout(xaxis_title=None)
+    return fig_stress
+
+
+def build_weekly_volume_figure(df_weekly_volume_by_speed_zone):
+    # Création du graphique en barres empilées
+    weekly_totals = df_weekly_volume_by_speed_zone.groupby('week_start')['distance_km'].sum().reset_index()
+
+    fig_weekly = px.bar(
+        df_weekly_volume_by_speed_zone,
+        x='week_start',
+        y='distance_km',
+        color='speed_zone',
+        title="Distance Hebdomadaire par Zone de Vitesse (10 dernières semaines)",
+        labels={'week_start': 'Semaine du', 'distance_km': 'Distance (km)', 'speed_zone': 'Zone Vitesse'},
+        color_discrete_map=zone_colors,
+        category_orders={"speed_zone": zone_labels} # Pour ordonner les zones correctement
+    )
+    fig_weekly.update_layout(barmode='stack', xaxis_title=None,yaxis_title=None)
+
+    fig_weekly.add_traces(
+        px.scatter(
+            weekly_totals,
+            x='week_start',
+            y='distance_km',
+            text=weekly_totals['distance_km'].apply(lambda x: f'{x:.1f} km')
+        ).update_traces(
+            textposition='top center',
+            mode='text'
+        ).data
+    )
+    return fig_weekly
+
+
+def format_activity_table(df_activities):
+    """Prépare le tableau de détail des activités."""
+    return df_activities[[
+        'start_time_gmt', 'sport', 'distance_m', 'total_timer_time_s',
+        'total_ascent', 'avg_hr', 'workout_rpe', 'workout_feel'
+    ]].rename(columns={
+        'start_time_gmt': 'Date',
+        'sport': 'Sport',
+        'distance_m': 'Distance (m)',
+        'total_timer_time_s': 'Durée (s)',
+        'total_ascent': 'D+ (m)',
+        'avg_hr': 'FC Moy.',
+        'workout_rpe': 'RPE',
+        'workout_feel': 'Ressenti'
+    }).sort_values(by='Date', ascending=False)
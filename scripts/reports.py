@@ -0,0 +1,304 @@
+import os
+import json
+import argparse
+import hashlib
+import html
+import unicodedata
+import pandas as pd
+from datetime import datetime
+from functions import read_with_retry
+from metrics import (
+    PERIOD_OPTIONS, hr_bins, hr_zone_multipliers, speed_bins, zone_labels, get_period_dates,
+    get_weekly_volume_start, load_main_data, load_weekly_volume_by_speed_zone, calculate_daily_stress,
+    compute_kpis, build_daily_stress_figure, build_weekly_volume_figure, format_activity_table
+)
+
+# --- Configuration ---
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+DATABASE_FILE = os.path.join(PROJECT_ROOT, "garmin_data.db")
+REPORTS_DIRECTORY = os.path.join(PROJECT_ROOT, "reports")
+MANIFEST_FILE = "manifest.json"
+
+# Bump when the content of the snapshots changes, so that they are all rebuilt
+SNAPSHOT_FORMAT_VERSION = 1
+
+# The 10-week speed-zone chart is the same for every period, so it has its own snapshot
+WEEKLY_VOLUME_KEY = "weekly_volume"
+
+
+def get_period_slug(period_option):
+    """Turns a period label into a file name, e.g. 'Année en cours' -> 'annee_en_cours'."""
+    ascii_label = unicodedata.normalize('NFKD', period_option).encode('ascii', 'ignore').decode()
+    return ascii_label.lower().replace(' ', '_').replace('-', '_')
+
+
+def get_snapshot_dates(key, today):
+    """
+    Date range of the activities a snapshot depends on. The speed-zone chart and the
+    periods that are not over yet (e.g. 'Année en cours', whose end date is today)
+    have no upper bound, so that their snapshot stays valid from one day to the next
+    until an import adds an activity.
+    """
+    if key == WEEKLY_VOLUME_KEY:
+        return get_weekly_volume_start(today), None
+    start_date, end_date = get_period_dates(key, today)
+    return start_date, (end_date if end_date < today else None)
+
+
+def compute_fingerprint(database_file, start_date, end_date=None):
+    """
+    Hashes everything a snapshot depends on: every activity row between two dates,
+    the first and last record of each (through the records index, so re-imported
+    records are noticed without reading them all), the schema and backfill state, the
+    personal zone settings of metrics.py and the snapshot format. The fingerprint
+    changes when an import touches that range, a backfill updates rows in place or
+    the zones are edited.
+    """
+    end_str = end_date.strftime('%Y-%m-%d') if end_date else '9999-12-31'
+    activities_query = """
+        SELECT a.*,
+            (SELECT MIN(r.timestamp) FROM records r WHERE r.activity_id = a.activity_id),
+            (SELECT r.rowid || ' ' || r.timestamp FROM records r
+             WHERE r.activity_id = a.activity_id ORDER BY r.timestamp DESC LIMIT 1)
+        FROM activities a
+        WHERE DATE(a.start_time_gmt) BETWEEN ? AND ?
+        ORDER BY a.activity_id
+    """
+    schema_query = "SELECT version, backfilled_at FROM schema_migrations ORDER BY version"
+
+    def read_state(con):
+        return (
+            con.execute(activities_query, (start_date.strftime('%Y-%m-%d'), end_str)).fetchall(),
+            con.execute(schema_query).fetchall(),
+        )
+
+    settings = (SNAPSHOT_FORMAT_VERSION, hr_bins, hr_zone_multipliers, speed_bins, zone_labels)
+    state = read_with_retry(read_state, database_file)
+    return hashlib.sha256(repr((settings, state)).encode()).hexdigest()
+
+
+def _frame_to_json(df):
+    return df.astype(object).where(df.notna(), None).to_dict(orient='split', index=False)
+
+
+def _frame_from_json(data):
+    return pd.DataFrame(data['data'], columns=data['columns'])
+
+
+def _write_file(file_path, content):
+    """Writes through a temporary file so the dashboard never reads a half-written snapshot."""
+    tmp_path = f"{file_path}.tmp"
+    with open(tmp_path, 'w') as f:
+        f.write(content)
+    os.replace(tmp_path, file_path)
+
+
+def _read_json(file_path):
+    try:
+        with open(file_path, 'r') as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+
+def read_manifest(reports_directory):
+    return _read_json(os.path.join(reports_directory, MANIFEST_FILE)) or {}
+
+
+def build_snapshot(database_file, key, today):
+    """Runs the dashboard computations behind one snapshot and returns them as a JSON-ready dict."""
+    start_date, fingerprint_end_date = get_snapshot_dates(key, today)
+    # Taken before the loaders: an import running meanwhile leaves the snapshot stale, not wrong
+    snapshot = {
+        "start_date": start_date.isoformat(),
+        "end_date": None,
+        "generated_at": datetime.now().isoformat(timespec='seconds'),
+        "fingerprint": compute_fingerprint(database_file, start_date, fingerprint_end_date),
+    }
+
+    if key == WEEKLY_VOLUME_KEY:
+        df_weekly_volume = load_weekly_volume_by_speed_zone(database_file, today)
+        snapshot["weekly_volume_by_speed_zone"] = _frame_to_json(df_weekly_volume)
+    else:
+        end_date = get_period_dates(key, today)[1]
+        snapshot["end_date"] = end_date.isoformat()
+        df_activities = load_main_data(database_file, start_date, end_date)
+        df_daily_stress = calculate_daily_stress(database_file, start_date, end_date)
+        df_daily_stress['activity_date'] = df_daily_stress['activity_date'].astype(str)
+        snapshot["period"] = key
+        snapshot["activities"] = _frame_to_json(df_activities)
+        snapshot["daily_stress"] = _frame_to_json(df_daily_stress)
+    return snapshot
+
+
+def is_snapshot_fresh(entry, database_file, key, today):
+    """
+    A snapshot is fresh if it starts on the same day as today's period and its
+    fingerprint did not change since (the start date identifies a standard period).
+    """
+    if not entry:
+        return False
+    start_date, end_date = get_snapshot_dates(key, today)
+    if entry['start_date'] != start_date.isoformat():
+        return False
+    return entry['fingerprint'] == compute_fingerprint(database_file, start_date, end_date)
+
+
+def render_html(period_snapshot, weekly_snapshot):
+    """Renders a period as a self-contained HTML page (plotly.js is inlined)."""
+    df_activities = _frame_from_json(period_snapshot['activities'])
+    df_daily_stress = _frame_from_json(period_snapshot['daily_stress'])
+    df_weekly_volume = _frame_from_json(weekly_snapshot['weekly_volume_by_speed_zone'])
+    period = html.escape(period_snapshot['period'])
+    start_date = datetime.fromisoformat(period_snapshot['start_date']).strftime('%d/%m/%Y')
+    end_date = datetime.fromisoformat(period_snapshot['end_date']).strftime('%d/%m/%Y')
+
+    sections = [
+        "<h1>Dashboard d'Analyse d'Entraînement</h1>",
+        f"<h3>Vue d'ensemble pour la période : <em>{period}</em></h3>",
+        f"<p>Période : {start_date} au {end_date} — généré le {period_snapshot['generated_at']}</p>",
+    ]
+    if df_activities.empty:
+        sections.append("<p>Aucune donnée disponible pour la période sélectionnée.</p>")
+    else:
+        kpis = compute_kpis(df_activities)
+        sections.append(
+            f"<p><strong>Distance Totale :</strong> {kpis['total_kms']:.2f} km &nbsp; "
+            f"<strong>Sessions :</strong> {kpis['total_sessions']} &nbsp; "
+            f"<strong>Temps d'effort :</strong> {kpis['total_temps_minutes']:.0f} min</p>"
+        )
+
+        # plotly.js is embedded once, with the first figure
+        include_plotlyjs = True
+        if not df_daily_stress.empty:
+            fig_stress = build_daily_stress_figure(df_daily_stress)
+            sections.append(fig_stress.to_html(full_html=False, include_plotlyjs=include_plotlyjs))
+            include_plotlyjs = False
+        if not df_weekly_volume.empty:
+            fig_weekly = build_weekly_volume_figure(df_weekly_volume)
+            sections.append(fig_weekly.to_html(full_html=False, include_plotlyjs=include_plotlyjs))
+
+        sections.append("<h3>Détail des Activités</h3>")
+        sections.append(format_activity_table(df_activities).to_html(index=False))
+
+    body = "\n".join(sections)
+    return (
+        "<!DOCTYPE html>\n<html lang=\"fr\">\n<head>\n<meta charset=\"utf-8\">\n"
+        f"<title>Suivi de la charge d'entrainement - {period}</title>\n"
+        f"</head>\n<body>\n{body}\n</body>\n</html>\n"
+    )
+
+
+def _load_fresh_snapshot(database_file, key, slug, reports_directory, today):
+    entry = read_manifest(reports_directory).get(slug)
+    if not is_snapshot_fresh(entry, database_file, key, today):
+        return None
+    return _read_json(os.path.join(reports_directory, entry['json_file']))
+
+
+def load_fresh_period_snapshot(database_file, period_option, reports_directory=REPORTS_DIRECTORY, today=None):
+    """
+    Returns the activities and daily stress DataFrames of a period if its snapshot is
+    still up to date with the database, or None so that the caller falls back to
+    live queries.
+    """
+    today = today or datetime.now().date()
+    snapshot = _load_fresh_snapshot(database_file, period_option, get_period_slug(period_option), reports_directory, today)
+    if snapshot is None:
+        return None
+    return _frame_from_json(snapshot['activities']), _frame_from_json(snapshot['daily_stress'])
+
+
+def load_fresh_weekly_volume_snapshot(database_file, reports_directory=REPORTS_DIRECTORY, today=None):
+    """Same as load_fresh_period_snapshot, for the 10-week speed-zone chart."""
+    today = today or datetime.now().date()
+    snapshot = _load_fresh_snapshot(database_file, WEEKLY_VOLUME_KEY, WEEKLY_VOLUME_KEY, reports_directory, today)
+    if snapshot is None:
+        return None
+    return _frame_from_json(snapshot['weekly_volume_by_speed_zone'])
+
+
+def refresh_snapshot(database_file, key, slug, manifest, reports_directory, today, force):
+    """Rebuilds a snapshot if it is stale. Returns the snapshot and whether it was rebuilt."""
+    entry = manifest.get(slug)
+    if not force and is_snapshot_fresh(entry, database_file, key, today):
+        snapshot = _read_json(os.path.join(reports_directory, entry['json_file']))
+        if snapshot is not None:
+            return snapshot, False
+
+    snapshot = build_snapshot(database_file, key, today)
+    json_file = f"{slug}.json"
+    _write_file(os.path.join(reports_directory, json_file), json.dumps(snapshot, ensure_ascii=False, default=str))
+    manifest[slug] = {
+        "start_date": snapshot['start_date'],
+        "end_date": snapshot['end_date'],
+        "fingerprint": snapshot['fingerprint'],
+        "generated_at": snapshot['generated_at'],
+        "json_file": json_file,
+    }
+    return snapshot, True
+
+
+def generate_reports(database_file, reports_directory=REPORTS_DIRECTORY, today=None, force=False):
+    """
+    Renders the standard periods into JSON and HTML snapshots. A period is only
+    recomputed when its dates changed or when an import touched its activities.
+    Returns the number of periods recomputed.
+    """
+    today = today or datetime.now().date()
+    os.makedirs(reports_directory, exist_ok=True)
+    manifest = read_manifest(reports_directory)
+
+    weekly_snapshot, weekly_changed = refresh_snapshot(
+        database_file, WEEKLY_VOLUME_KEY, WEEKLY_VOLUME_KEY, manifest, reports_directory, today, force
+    )
+    if weekly_changed:
+        print("Speed-zone chart snapshot generated.")
+
+    generated_count = 0
+    for period_option in PERIOD_OPTIONS:
+        slug = get_period_slug(period_option)
+        period_snapshot, period_changed = refresh_snapshot(
+            database_file, period_option, slug, manifest, reports_directory, today, force
+        )
+        html_file = f"{slug}.html"
+        html_path = os.path.join(reports_directory, html_file)
+
+        if period_changed:
+            generated_count += 1
+            print(f"Report '{period_option}' generated.")
+        elif weekly_changed or not os.path.exists(html_path):
+            # Only the shared speed-zone chart changed: re-render the page from the JSON snapshots
+            print(f"Report '{period_option}' re-rendered.")
+        else:
+            print(f"Report '{period_option}' is up to date. Skipping.")
+            continue
+
+        _write_file(html_path, render_html(period_snapshot, weekly_snapshot))
+        manifest[slug]["period"] = period_option
+        manifest[slug]["html_file"] = html_file
+
+    # The manifest is written last, so a snapshot is never referenced before it is complete
+    _write_file(os.path.join(reports_directory, MANIFEST_FILE), json.dumps(manifest, ensure_ascii=False, indent=2))
+    return generated_count
+
+
+def main():
+    """
+    Main function to regenerate the report snapshots after an import.
+    """
+    parser = argparse.ArgumentParser(description="Regenerate the report snapshots.")
+    parser.add_argument('--force', action='store_true', help="Rebuild every snapshot, even those still up to date")
+    args = parser.parse_args()
+
+    if not os.path.exists(DATABASE_FILE):
+        print(f"Database file '{DATABASE_FILE}' does not exist. No reports generated.")
+        return
+
+    print("\n\n--- Generating Report Snapshots ---")
+    generated_count = generate_reports(DATABASE_FILE, force=args.force)
+    print(f"Reports recomputed: {generated_count}, up to date: {len(PERIOD_OPTIONS) - generated_count}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+import os
+import argparse
+import tempfile
+import threading
+import time
+import multiprocessing
+from datetime import datetime, timedelta
+from functions import create_database, populate_tables, make_activity_id
+import metrics
+
+# --- Stress test: importer writing while the dashboard is reading ---
+# Runs a simulated import (synthetic activities, one write transaction each) in its
+# own process, like run_garmin_pipeline.sh next to Streamlit, alongside several
+# threads running the dashboard's loaders, then reports the read latency
+# percentiles of each loader.
+
+# Reads run through the same loaders as the dashboard (metrics.py)
+DASHBOARD_LOADERS = {
+    'load_main_data': lambda database_file, start, end: metrics.load_main_data(database_file, start, end),
+    'load_weekly_volume_by_speed_zone':
+        lambda database_file, start, end: metrics.load_weekly_volume_by_speed_zone(database_file),
+    'calculate_daily_stress': lambda database_file, start, end: metrics.calculate_daily_stress(database_file, start, end),
+}
+
+
+def make_activity(start_time, records_per_activity):
+    """Builds a synthetic activity shaped like get_filtered_activity_data's output."""
+    activity_id = make_activity_id(start_time)
+    records = []
+    for i in range(records_per_activity):
+        records.append({
+            'timestamp': start_time + timedelta(seconds=i),
+            'heart_rate': 120 + i % 70,
+            'cadence': 85,
+            'distance': i * 3.2,
+            'power': 250,
+            'enhanced_speed': 3.2,
+            'enhanced_altitude': 100.0,
+        })
+    return {
+        "activity": {
+            'activity_id': activity_id,
+            'start_time': start_time,
+            'sport': 'running',
+            'total_distance': records_per_activity * 3.2,
+            'total_elapsed_time': records_per_activity,
+            'total_timer_time': records_per_activity,
+            'avg_heart_rate': 150,
+            'unknown_193': 5,
+            'unknown_192': 50,
+        },
+        "laps": [{'activity_id': activity_id, 'start_time': start_time, 'lap_trigger': 'manual'}],
+        "records": records,
+    }
+
+
+def run_importer(database_file, activities, records_per_activity, result_queue):
+    """
+    Imports synthetic activities one after the other, like main.py does, then sends
+    the write transaction durations back to the parent process.
+    """
+    first_start = datetime.now() - timedelta(days=activities)
+    write_durations = []
+    for n in range(activities):
+        data = make_activity(first_start + timedelta(days=n), records_per_activity)
+        t0 = time.perf_counter()
+        populate_tables(data, database_file)
+        write_durations.append(time.perf_counter() - t0)
+    result_queue.put(write_durations)
+
+
+def run_reader(database_file, stop_event, latencies, errors):
+    """Runs the dashboard loaders in a loop until the importer is done."""
+    start = (datetime.now() - timedelta(days=365)).date()
+    end = datetime.now().date()
+    loader_names = list(DASHBOARD_LOADERS)
+    n = 0
+    while not stop_event.is_set():
+        loader_name = loader_names[n % len(loader_names)]
+        n += 1
+        t0 = time.perf_counter()
+        try:
+            DASHBOARD_LOADERS[loader_name](database_file, start, end)
+            latencies[loader_name].append(time.perf_counter() - t0)
+        except Exception as e:
+            errors.append(f"{loader_name}: {e}")
+
+
+def percentile(sorted_values, p):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return float('nan')
+    index = min(len(sorted_values) - 1, max(0, int(round(p / 100 * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Concurrent import / dashboard read stress test.")
+    parser.add_argument('--activities', type=int, default=200, help="Number of activities to import")
+    parser.add_argument('--records', type=int, default=3600, help="Records (seconds) per activity")
+    parser.add_argument('--readers', type=int, default=8, help="Number of simulated dashboard sessions")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        database_file = os.path.join(tmp_dir, "stress_test.db")
+        create_database(database_file)
+
+        stop_event = threading.Event()
+        latencies = {loader_name: [] for loader_name in DASHBOARD_LOADERS}
+        errors = []
+        readers = [
+            threading.Thread(target=run_reader, args=(database_file, stop_event, latencies, errors))
+            for _ in range(args.readers)
+        ]
+        for reader in readers:
+            reader.start()
+
+        # A separate process, so that the readers only wait on SQLite, not on the GIL.
+        # Spawned rather than forked: a fork would copy the locks held by the reader threads.
+        spawn = multiprocessing.get_context('spawn')
+        result_queue = spawn.Queue()
+        importer = spawn.Process(
+            target=run_importer, args=(database_file, args.activities, args.records, result_queue)
+        )
+        t0 = time.perf_counter()
+        importer.start()
+        write_durations = result_queue.get()
+        importer.join()
+        import_duration = time.perf_counter() - t0
+
+        stop_event.set()
+        for reader in readers:
+            reader.join()
+
+    write_durations.sort()
+    print("\n\n--- Stress Test Results ---")
+    print(f"Import: {args.activities} activities in {import_duration:.1f} s "
+          f"(longest write transaction: {write_durations[-1] * 1000:.0f} ms)")
+    read_count = sum(len(loader_latencies) for loader_latencies in latencies.values())
+    print(f"Reads: {read_count} succeeded, {len(errors)} failed, {args.readers} concurrent readers")
+    for loader_name, loader_latencies in latencies.items():
+        loader_latencies.sort()
+        print(f"  {loader_name} ({len(loader_latencies)} reads)")
+        for p in (50, 90, 95, 99):
+            print(f"    p{p}: {percentile(loader_latencies, p) * 1000:.1f} ms")
+        if loader_latencies:
+            print(f"    max: {loader_latencies[-1] * 1000:.1f} ms")
+    for error in sorted(set(errors)):
+        print(f"  Error: {error}")
+
+
+if __name__ == "__main__":
+    main()